@@ -1,17 +1,47 @@
 import os
+import re
+import errno
 import fnmatch
+import struct
+import sys
 import time
 import argparse
+import functools
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import glob
+
+try:
+    # Optional: google-re2 matches in linear time, so hostile patterns can't cause backtracking
+    import re2 as _re
+except ImportError:
+    _re = re
+
+# Separator written around each file's relative path
+SEP_L = b'\n======='
+SEP_R = b'=======\n'
+
+# Bytes sniffed for NUL to detect binary files; smaller files are read whole by the workers
+SNIFF_SIZE = 1 << 16
+
+# Header of each file in the frames output format: path length (u32), body length (u64)
+FRAME_HEADER = struct.Struct('<IQ')
+
+# Errors meaning a kernel-space copy isn't supported for this pair of files
+_COPY_FALLBACK_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK}
 
 class Contextro:
-    def __init__(self, root_dir='.', ignore_file='.contextignore'):
+    def __init__(self, root_dir='.', ignore_file='.contextignore', output_format='text', follow_symlinks=False):
         self.root_dir = Path(root_dir).resolve()
         self.ignore_file = self.root_dir / ignore_file
+        self._ignore_file_name = self.ignore_file.name
+        self._output_name = None
+        self.output_format = output_format
+        self.follow_symlinks = follow_symlinks
         self.ignore_patterns = self._load_ignore_patterns()
         self.ignore_patterns.append('contextro_context_*.txt')
+        self._compile_ignore_patterns()
 
     def _load_ignore_patterns(self):
         """Load and parse the .contextignore file, similar to .gitignore"""
@@ -25,100 +55,398 @@ class Contextro:
                         patterns.append(line)
         return patterns
 
-    def _should_ignore(self, path):
+    @staticmethod
+    def _translate(pattern):
         """
-        Check if a path should be ignored based on .contextignore patterns.
-        Implements gitignore-style pattern matching.
+        Translate a glob pattern into a regex to be used with fullmatch.
+        Same semantics as fnmatch.translate, but without the anchors and atomic
+        groups it emits, which re2 doesn't support. Only used with re2: without
+        the atomic groups, runs of stars backtrack exponentially in re.
         """
-        # Convert path to relative path from root_dir
-        rel_path = str(Path(path).resolve().relative_to(self.root_dir))
-        
-        # Also create path with trailing slash for directory matching
-        rel_path_with_slash = rel_path + '/' if os.path.isdir(path) else rel_path
-        
+        res = []
+        i, n = 0, len(pattern)
+        while i < n:
+            c = pattern[i]
+            i += 1
+            if c == '*':
+                # Collapse consecutive stars
+                if not res or res[-1] != '.*':
+                    res.append('.*')
+            elif c == '?':
+                res.append('.')
+            elif c == '[':
+                j = i
+                if j < n and pattern[j] == '!':
+                    j += 1
+                if j < n and pattern[j] == ']':
+                    j += 1
+                while j < n and pattern[j] != ']':
+                    j += 1
+                if j >= n:
+                    # Unterminated set, match a literal '['
+                    res.append('\\[')
+                    continue
+                if '-' not in pattern[i:j]:
+                    stuff = pattern[i:j].replace('\\', r'\\')
+                else:
+                    # Split on range hyphens and drop empty ranges like z-a, as fnmatch does
+                    chunks = []
+                    k = i + 2 if pattern[i] == '!' else i + 1
+                    while True:
+                        k = pattern.find('-', k, j)
+                        if k < 0:
+                            break
+                        chunks.append(pattern[i:k])
+                        i = k + 1
+                        k = k + 3
+                    chunk = pattern[i:j]
+                    if chunk:
+                        chunks.append(chunk)
+                    else:
+                        chunks[-1] += '-'
+                    for k in range(len(chunks) - 1, 0, -1):
+                        if chunks[k - 1][-1] > chunks[k][0]:
+                            chunks[k - 1] = chunks[k - 1][:-1] + chunks[k][1:]
+                            del chunks[k]
+                    stuff = '-'.join(part.replace('\\', r'\\').replace('-', r'\-') for part in chunks)
+                stuff = re.sub(r'([&~|\[])', r'\\\1', stuff)
+                i = j + 1
+                if not stuff:
+                    # Empty set, never matches
+                    res.append(r'\b\B')
+                elif stuff == '!':
+                    # Negated empty set, any character
+                    res.append('.')
+                else:
+                    if stuff[0] == '!':
+                        stuff = '^' + stuff[1:]
+                    elif stuff[0] == '^':
+                        stuff = '\\' + stuff
+                    res.append(f'[{stuff}]')
+            else:
+                res.append(re.escape(c))
+        return ''.join(res)
+
+    @classmethod
+    def _compile_union(cls, patterns):
+        """
+        Compile glob patterns into a single regex and return its matching function,
+        or None if there are no patterns.
+        """
+        if not patterns:
+            return None
+        if _re is re:
+            # fnmatch.translate anchors the regex and uses atomic groups against backtracking
+            return re.compile('|'.join(f"(?:{fnmatch.translate(p)})" for p in patterns)).match
+        return _re.compile('(?s:' + '|'.join(f"(?:{cls._translate(p)})" for p in patterns) + ')').fullmatch
+
+    @staticmethod
+    def _is_literal(pattern):
+        """Check if a pattern is a plain name with no glob characters"""
+        return not any(c in pattern for c in '*?[!')
+
+    def _compile_ignore_patterns(self):
+        """
+        Partition the ignore patterns and precompile each group into regexes.
+        Patterns without a slash match a single path segment: ignored directories
+        are pruned during the walk, so testing the basename covers every ancestor.
+        Patterns containing a slash are anchored to the root and match the full path,
+        unless they start with '**/', which lets them match at any depth.
+        """
+        neg, dir_only, file_or_dir = ([], []), ([], []), ([], [])
         for pattern in self.ignore_patterns:
-            # Handle pattern variations
-            pattern_variations = [
-                pattern,                    # Original pattern
-                f"**/{pattern}",           # Match in any subdirectory
-                f"**/{pattern}/**"         # Match all contents in any subdirectory
-            ]
-            
-            # Handle negation patterns
             if pattern.startswith('!'):
-                clean_pattern = pattern[1:]
-                for var in pattern_variations:
-                    if fnmatch.fnmatch(rel_path, clean_pattern):
-                        return False
+                group, pattern = neg, pattern[1:]
+            elif pattern.endswith('/'):
+                group = dir_only
+            else:
+                group = file_or_dir
+            pattern = pattern.rstrip('/')
+            if pattern.startswith('**/'):
+                pattern = pattern[3:]
+                if '/' in pattern:
+                    # Still matches at any depth: '*' crosses slashes, so '*/' covers (?:.*/)
+                    group[1].extend((pattern, '*/' + pattern))
+                    continue
+            if '/' in pattern:
+                group[1].append(pattern.lstrip('/'))
             else:
-                for var in pattern_variations:
-                    # Handle directory-specific patterns
-                    if pattern.endswith('/'):
-                        if fnmatch.fnmatch(rel_path_with_slash, var):
-                            return True
-                    # Handle regular patterns
-                    elif fnmatch.fnmatch(rel_path, var):
-                        return True
-        return False
-
-    def _is_binary(self, path):
-        """Check if a file is binary by reading its first few bytes"""
+                group[0].append(pattern)
+        self._neg_re = tuple(map(self._compile_union, neg))
+        self._dir_re = tuple(map(self._compile_union, dir_only))
+        self._any_re = tuple(map(self._compile_union, file_or_dir))
+
+        # Basename verdicts are shared by every entry with the same name (index.js,
+        # __init__.py, ...), so cache them per instance
+        self._name_verdict = functools.lru_cache(maxsize=8192)(functools.partial(self._verdict, 0))
+
+        # Plain directory names (.git, node_modules, ...) are pruned with a set lookup.
+        # Names that any negation could re-include, including anchored negations whose
+        # last segment matches the name, are left to the regular matcher.
+        neg_tails = [p.rpartition('/')[2] for p in neg[1]]
+        self._literal_dir_ignores = {
+            name for name in dir_only[0] + file_or_dir[0]
+            if self._is_literal(name) and self._name_verdict(name, True) is not False
+            and not any(fnmatch.fnmatchcase(name, tail) for tail in neg_tails)
+        }
+
+    def _verdict(self, index, subject, is_dir):
+        """
+        Match a basename (index 0) or full relative path (index 1) against the patterns.
+        Returns False if a negation pattern matches, True if an ignore pattern matches,
+        and None if nothing matches.
+        """
+        neg_re, dir_re, any_re = self._neg_re[index], self._dir_re[index], self._any_re[index]
+        # Negation patterns always win
+        if neg_re and neg_re(subject):
+            return False
+        # Directory-specific patterns only apply to directories
+        if is_dir and dir_re and dir_re(subject):
+            return True
+        if any_re and any_re(subject):
+            return True
+        return None
+
+    def _should_ignore(self, rel_path, is_dir):
+        """
+        Check if a path should be ignored based on .contextignore patterns.
+        Implements gitignore-style pattern matching.
+        """
+        name_verdict = self._name_verdict(rel_path.rpartition('/')[2], is_dir)
+        if name_verdict is False:
+            return False
+        # Anchored patterns can still negate or ignore the path
+        path_verdict = self._verdict(1, rel_path, is_dir)
+        if path_verdict is not None:
+            return path_verdict
+        return bool(name_verdict)
+
+    def _scan(self, path, parent_rel='', ancestors=None):
+        """
+        Recursively yield (file_path, rel_path) for every non-ignored file under path.
+        Old contextro_context_*.txt files in the root are deleted as they are found.
+        Uses os.scandir so file types come from the directory listing itself,
+        and builds relative paths by concatenation instead of resolving them.
+        Symlinked directories are only descended into when following symlinks,
+        in which case ancestors holds the (st_dev, st_ino) of the directories on
+        the current chain, so only true cycles are cut.
+        """
+        # Bind attributes used per entry to locals
+        should_ignore = self._should_ignore
+        literal_dir_ignores = self._literal_dir_ignores
+        ignore_file_name, output_name = self._ignore_file_name, self._output_name
+        follow_symlinks = ancestors is not None
+        prefix = parent_rel + '/' if parent_rel else ''
+
+        subdirs = []
         try:
-            with open(path, 'rb') as f:
-                chunk = f.read(1024)
-                return b'\0' in chunk
+            with os.scandir(path) as it:
+                for entry in it:
+                    name = entry.name
+                    rel_path = prefix + name
+                    # Checks that follow symlinks can fail on a single entry (ELOOP, EACCES)
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                        is_file = not is_dir and entry.is_file()
+                    except OSError as e:
+                        print(f"Error scanning {entry.path}: {e}")
+                        continue
+                    if is_dir:
+                        if name in literal_dir_ignores:
+                            continue
+                        subdirs.append((entry, rel_path))
+                    elif is_file:
+                        # Delete old context files found in the root
+                        if not parent_rel and name.startswith('contextro_context_') and name.endswith('.txt'):
+                            try:
+                                os.unlink(entry.path)
+                                print(f"Deleted old context file: {entry.path}")
+                            except OSError as e:
+                                print(f"Error deleting {entry.path}: {e}")
+                            continue
+                        # Skip the output file itself and the ignore file
+                        if name == output_name or name == ignore_file_name:
+                            continue
+                        if not should_ignore(rel_path, False):
+                            yield entry.path, rel_path
+        except OSError as e:
+            # Still walk the subdirectories listed before the failure
+            print(f"Error scanning {path}: {e}")
+
+        # Descend after the files, keeping os.walk's top-down output order.
+        # Ignored subtrees are never entered.
+        for entry, rel_path in subdirs:
+            if should_ignore(rel_path, True):
+                continue
+            if not follow_symlinks:
+                yield from self._scan(entry.path, rel_path)
+                continue
+            try:
+                st = entry.stat()
+            except OSError as e:
+                print(f"Error scanning {entry.path}: {e}")
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key in ancestors:
+                continue
+            ancestors.add(key)
+            try:
+                yield from self._scan(entry.path, rel_path, ancestors)
+            finally:
+                ancestors.discard(key)
+
+    @staticmethod
+    def _advise(f, advice):
+        """Give the kernel a best-effort posix_fadvise hint, where the platform supports it"""
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, getattr(os, advice))
+            except OSError:
+                pass
+
+    def _open_file(self, file_path):
+        """
+        Open a file and sniff its first chunk.
+        Returns (file, head), or None if the file is binary.
+        """
+        # Unbuffered, so the file position stays exactly at the end of the sniffed head
+        f = open(file_path, 'rb', buffering=0)
+        # Each file is read once, front to back
+        self._advise(f, 'POSIX_FADV_SEQUENTIAL')
+        try:
+            head = f.read(SNIFF_SIZE)
+            # Unbuffered reads can come back short before EOF (FUSE, procfs, signals)
+            while head and len(head) < SNIFF_SIZE:
+                more = f.read(SNIFF_SIZE - len(head))
+                if not more:
+                    break
+                head += more
         except Exception:
-            return True
+            f.close()
+            raise
+        if b'\0' in head:
+            f.close()
+            return None
+        return f, head
 
-    def _cleanup_old_context_files(self):
-        """Delete any existing context_{timestamp}.txt files"""
-        pattern = self.root_dir / 'contextro_context_*.txt'
-        for file in glob.glob(str(pattern)):
+    @staticmethod
+    def _copy_rest(f, out, count=None):
+        """
+        Copy the rest of f, or at most count bytes of it, into out in kernel space.
+        Prefers copy_file_range, then sendfile, and falls back to a read/write loop
+        if neither is supported or neither copies anything.
+        Returns the number of bytes copied.
+        """
+        # Kernel copies write straight to the fd, so pending output has to go first
+        out.flush()
+        in_fd, out_fd = f.fileno(), out.fileno()
+        total = remaining = sys.maxsize if count is None else count
+        copies = []
+        if hasattr(os, 'copy_file_range'):
+            copies.append(lambda n: os.copy_file_range(in_fd, out_fd, n))
+        if hasattr(os, 'sendfile'):
+            copies.append(lambda n: os.sendfile(out_fd, in_fd, None, n))
+        for copy in copies:
+            copied_any = False
             try:
-                os.remove(file)
-                print(f"Deleted old context file: {file}")
-            except Exception as e:
-                print(f"Error deleting {file}: {e}")
+                while remaining > 0:
+                    copied = copy(min(remaining, 1 << 30))
+                    if not copied:
+                        break
+                    copied_any = True
+                    remaining -= copied
+            except OSError as e:
+                if e.errno not in _COPY_FALLBACK_ERRNOS:
+                    raise
+                continue
+            # Some pseudo and FUSE filesystems return 0 without being at EOF,
+            # so only trust the result if something was copied
+            if copied_any:
+                return total - remaining
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            out.write(chunk)
+            remaining -= len(chunk)
+        return total - remaining
+
+    def _write_file(self, out, file_path, rel_path, future):
+        """Write one file, opened by a worker thread, to the output"""
+        try:
+            opened = future.result()
+            # Skip binary files
+            if opened is None:
+                return
+            f, head = opened
+            # Encode before writing anything, using the on-disk bytes for non-UTF-8 names
+            rel_bytes = os.fsencode(rel_path)
+            with f:
+                if self.output_format == 'frames':
+                    # Length-prefixed frame, the body length comes from a single fstat
+                    # and exactly that many bytes are written
+                    size = os.fstat(f.fileno()).st_size
+                    body = head[:size]
+                    out.write(FRAME_HEADER.pack(len(rel_bytes), size))
+                    out.write(rel_bytes)
+                    out.write(body)
+                    missing = size - len(body)
+                    if missing:
+                        missing -= self._copy_rest(f, out, missing)
+                    if missing:
+                        # The file shrank while being read; pad with NULs to keep later frames aligned
+                        print(f"Error processing {file_path}: file shrank, padded {missing} bytes")
+                        while missing:
+                            pad = min(missing, 1 << 20)
+                            out.write(bytes(pad))
+                            missing -= pad
+                else:
+                    # Write the separator
+                    out.write(SEP_L)
+                    out.write(rel_bytes)
+                    out.write(SEP_R)
+                    
+                    # Stream the rest of the file from the same handle.
+                    # A short head means the whole file has already been read.
+                    out.write(head)
+                    if len(head) == SNIFF_SIZE:
+                        self._copy_rest(f, out)
+                # Drop the pages from the cache, they won't be read again
+                self._advise(f, 'POSIX_FADV_DONTNEED')
+        except Exception as e:
+            print(f"Error processing {file_path}: {e}")
 
     def build_context(self):
         """
         Build the context file by concatenating all non-ignored files,
-        separated by the specified delimiter.
+        separated by the specified delimiter, or as length-prefixed frames.
         """
-        # Clean up old context files first
-        self._cleanup_old_context_files()
-        
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         output_file = self.root_dir / f'contextro_context_{timestamp}.txt'
+        self._output_name = output_file.name
+        
+        # Collect the files up front so reads can be dispatched ahead of the writer.
+        # This also deletes old context files, before the new one is created.
+        ancestors = None
+        if self.follow_symlinks:
+            st = os.stat(self.root_dir)
+            ancestors = {(st.st_dev, st.st_ino)}
+        files = list(self._scan(self.root_dir, ancestors=ancestors))
         
-        with open(output_file, 'w', encoding='utf-8') as out:
-            for root, dirs, files in os.walk(self.root_dir):
-                # Skip the output file itself and the .contextignore file
-                files = [f for f in files if f != output_file and f != '.contextignore']
-                
-                # Remove ignored directories
-                dirs[:] = [d for d in dirs if not self._should_ignore(os.path.join(root, d))]
-                
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if not self._should_ignore(file_path):
-                        try:
-                            # Skip binary files
-                            if self._is_binary(file_path):
-                                continue
-                                
-                            # Get relative path for the separator
-                            rel_path = os.path.relpath(file_path, self.root_dir)
-                            
-                            # Write the separator
-                            out.write(f"\n{'=' * 7}{rel_path}{'=' * 7}\n")
-                            
-                            # Write the file contents
-                            with open(file_path, 'r', encoding='utf-8') as f:
-                                out.write(f.read())
-                                
-                        except Exception as e:
-                            print(f"Error processing {file_path}: {e}")
+        # Worker threads open and sniff files while the main thread writes them in order.
+        # The number of files in flight is bounded to cap open handles.
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+        window = max_workers * 2
+        open_file, write_file = self._open_file, self._write_file
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, open(output_file, 'wb', buffering=1 << 20) as out:
+            submit = executor.submit
+            pending = deque()
+            for file_path, rel_path in files:
+                pending.append((file_path, rel_path, submit(open_file, file_path)))
+                if len(pending) >= window:
+                    write_file(out, *pending.popleft())
+            while pending:
+                write_file(out, *pending.popleft())
 
         print(f"Context file created: {output_file}")
         return output_file
@@ -129,11 +457,15 @@ def main():
                       help='Directory to process (default: current directory)')
     parser.add_argument('--ignore-file', default='.contextignore',
                       help='Name of the ignore file (default: .contextignore)')
+    parser.add_argument('--follow-symlinks', action='store_true',
+                      help='Descend into symlinked directories (default: symlinked directories are skipped)')
+    parser.add_argument('--format', choices=['text', 'frames'], default='text',
+                      help='Output format: delimited text, or length-prefixed frames (default: text)')
     
     args = parser.parse_args()
     
     try:
-        builder = Contextro(args.directory, args.ignore_file)
+        builder = Contextro(args.directory, args.ignore_file, args.format, args.follow_symlinks)
         builder.build_context()
     except Exception as e:
         print(f"Error: {e}")